@@ -1,7 +1,10 @@
+import atexit
 import os
+import queue
 import sqlite3
 from flask import Flask, jsonify, request, render_template
 from dotenv import load_dotenv
+from scripts.schema import CREATE_TABLE_SQL, INDEXES, ROLLUPS, ensure_generated_columns
 
 # Load .env
 load_dotenv()
@@ -11,23 +14,51 @@ app = Flask(__name__)
 DATABASE_URL = os.getenv("DATABASE_URL", "sqlite:///data/db/nyc.db")
 FLASK_DEBUG = os.getenv("FLASK_DEBUG", "0")
 
-def get_db_path():
-    if DATABASE_URL.startswith("sqlite:///"):
-        return DATABASE_URL.replace("sqlite:///", "", 1)
-    return "data/db/nyc.db"
+# Resolved once; the URL can't change for the life of the process
+DB_PATH = DATABASE_URL[len("sqlite:///"):] if DATABASE_URL.startswith("sqlite:///") else "data/db/nyc.db"
 
 # ----------------- DB Helpers ----------------- #
-def query_db(sql, params=()):
-    conn = sqlite3.connect(get_db_path())
+# Small shared pool of read-only connections, reused across requests and threads
+# (Werkzeug's threaded dev server starts a new thread per request, so a per-thread cache wouldn't help).
+# Writes (execute_db, init_db) still open their own short-lived connection.
+READ_POOL_SIZE = 4
+_read_pool = queue.LifoQueue(maxsize=READ_POOL_SIZE)
+
+def _open_read_conn():
+    # check_same_thread=False: a pooled connection is used by one request at a time, but not always on the same thread
+    conn = sqlite3.connect(DB_PATH, check_same_thread=False)
     conn.row_factory = sqlite3.Row
-    cur = conn.cursor()
-    cur.execute(sql, params)
-    rows = cur.fetchall()
-    conn.close()
-    return rows
+    conn.execute("PRAGMA mmap_size=268435456")  # 256 MB memory-mapped reads
+    conn.execute("PRAGMA query_only=ON")
+    return conn
+
+def query_db(sql, params=()):
+    try:
+        conn = _read_pool.get_nowait()
+    except queue.Empty:
+        conn = _open_read_conn()
+    try:
+        cur = conn.cursor()
+        cur.execute(sql, params)
+        rows = cur.fetchall()
+        cur.close()
+        return rows
+    finally:
+        try:
+            _read_pool.put_nowait(conn)
+        except queue.Full:
+            conn.close()  # more concurrent requests than pool slots; don't keep the extra
+
+@atexit.register
+def _close_read_pool():
+    while True:
+        try:
+            _read_pool.get_nowait().close()
+        except queue.Empty:
+            break
 
 def execute_db(sql, params=()):
-    conn = sqlite3.connect(get_db_path())
+    conn = sqlite3.connect(DB_PATH)
     cur = conn.cursor()
     cur.execute(sql, params)
     conn.commit()
@@ -36,35 +67,18 @@ def execute_db(sql, params=()):
 # ----------------- Init (create table & indexes if missing) ----------------- #
 def init_db():
     os.makedirs("data/db", exist_ok=True)
-    conn = sqlite3.connect(get_db_path())
+    conn = sqlite3.connect(DB_PATH)
     cur = conn.cursor()
-    cur.execute("""
-        CREATE TABLE IF NOT EXISTS taxi_trips (
-            id TEXT PRIMARY KEY,
-            vendor_id TEXT,
-            pickup_datetime TEXT,
-            dropoff_datetime TEXT,
-            passenger_count INTEGER,
-            pickup_longitude REAL,
-            pickup_latitude REAL,
-            dropoff_longitude REAL,
-            dropoff_latitude REAL,
-            store_and_fwd_flag TEXT,
-            trip_duration INTEGER,
-            trip_distance_km REAL,
-            trip_speed_kmh REAL,
-            duration_category TEXT,
-            rush_hour_flag INTEGER
-        )
-    """)
+    cur.execute(CREATE_TABLE_SQL)
+    ensure_generated_columns(conn)
     # Helpful indexes for queries you run on the dashboard
-    cur.execute("CREATE INDEX IF NOT EXISTS idx_pickup_datetime ON taxi_trips (pickup_datetime)")
-    cur.execute("CREATE INDEX IF NOT EXISTS idx_duration_category ON taxi_trips (duration_category)")
-    cur.execute("CREATE INDEX IF NOT EXISTS idx_speed ON taxi_trips (trip_speed_kmh)")
-    cur.execute("CREATE INDEX IF NOT EXISTS idx_rush ON taxi_trips (rush_hour_flag)")
+    for name, target in INDEXES.items():
+        cur.execute(f"CREATE INDEX IF NOT EXISTS {name} ON {target}")
+    for name, select in ROLLUPS.items():
+        cur.execute(f"CREATE TABLE IF NOT EXISTS {name} AS {select}")
     conn.commit()
     conn.close()
-    print("✅ DB ready with indexes.")
+    print("✅ DB ready with indexes and summary tables.")
 
 with app.app_context():
     init_db()
@@ -76,12 +90,11 @@ def home():
 
 @app.route("/health")
 def health():
-    db_path = get_db_path()
     return jsonify({
         "status": "ok",
         "database_url": DATABASE_URL,
-        "sqlite_file_path": db_path,
-        "sqlite_file_exists": os.path.exists(db_path)
+        "sqlite_file_path": DB_PATH,
+        "sqlite_file_exists": os.path.exists(DB_PATH)
     })
 
 # ---------- Summary KPIs ---------- #
@@ -92,38 +105,25 @@ def api_summary():
     where = []
     params = []
     if start:
-        where.append("date(substr(pickup_datetime,1,19)) >= date(?)")
+        where.append("pickup_date >= date(?)")
         params.append(start)
     if end:
-        where.append("date(substr(pickup_datetime,1,19)) <= date(?)")
+        where.append("pickup_date <= date(?)")
         params.append(end)
     where_sql = ("WHERE " + " AND ".join(where)) if where else ""
     sql = f"""
         SELECT
-            COUNT(*) AS trips,
-            AVG(trip_duration) AS avg_duration_s,
-            AVG(trip_distance_km) AS avg_km,
-            AVG(trip_speed_kmh) AS avg_kmh
-        FROM taxi_trips
+            COALESCE(SUM(trips), 0) AS trips,
+            CAST(SUM(duration_sum) AS REAL) / SUM(duration_n) AS avg_duration_s,
+            SUM(km_sum) / SUM(km_n) AS avg_km,
+            SUM(kmh_sum) / SUM(kmh_n) AS avg_kmh
+        FROM summary_by_date
         {where_sql}
     """
     rows = query_db(sql, tuple(params))
     return jsonify(dict(rows[0]) if rows else {})
 
-# ---------- Busiest hours (custom selection sort) ---------- #
-def selection_sort_desc(pairs):
-    # Manual algorithm to satisfy “implement an algorithm yourself”
-    arr = pairs[:]
-    n = len(arr)
-    for i in range(n):
-        max_idx = i
-        for j in range(i + 1, n):
-            if arr[j][1] > arr[max_idx][1]:
-                max_idx = j
-        if max_idx != i:
-            arr[i], arr[max_idx] = arr[max_idx], arr[i]
-    return arr
-
+# ---------- Busiest hours (sorted + limited in SQL) ---------- #
 @app.route("/api/busiest_hours")
 def api_busiest_hours():
     k = int(request.args.get("k", "5"))
@@ -131,23 +131,25 @@ def api_busiest_hours():
     start = request.args.get("start")
     end = request.args.get("end")
     if start:
-        where.append("date(substr(pickup_datetime,1,19)) >= date(?)")
+        where.append("pickup_date >= date(?)")
         params.append(start)
     if end:
-        where.append("date(substr(pickup_datetime,1,19)) <= date(?)")
+        where.append("pickup_date <= date(?)")
         params.append(end)
     where_sql = ("WHERE " + " AND ".join(where)) if where else ""
     sql = f"""
-        SELECT CAST(strftime('%H', substr(pickup_datetime,1,19)) AS INTEGER) AS hour,
-               COUNT(*) AS trips
-        FROM taxi_trips
+        SELECT pickup_hour AS hour,
+               SUM(trips) AS trips
+        FROM busiest_hours_by_date
         {where_sql}
         GROUP BY hour
+        HAVING hour IS NOT NULL
+        ORDER BY trips DESC, hour
+        LIMIT ?
     """
+    params.append(k)
     rows = query_db(sql, tuple(params))
-    pairs = [(int(r["hour"]), int(r["trips"])) for r in rows if r["hour"] is not None]
-    sorted_pairs = selection_sort_desc(pairs)
-    return jsonify({"top": [{"hour": h, "trips": c} for h, c in sorted_pairs[:k]]})
+    return jsonify({"top": [{"hour": r["hour"], "trips": r["trips"]} for r in rows]})
 
 # ---------- Distribution by duration category ---------- #
 @app.route("/api/distribution")
@@ -161,10 +163,10 @@ def api_distribution():
 
     where, params = [], []
     if start:
-        where.append("date(substr(pickup_datetime,1,19)) >= date(?)")
+        where.append("pickup_date >= date(?)")
         params.append(start)
     if end:
-        where.append("date(substr(pickup_datetime,1,19)) <= date(?)")
+        where.append("pickup_date <= date(?)")
         params.append(end)
     if rush in ("0","1"):
         where.append("rush_hour_flag = ?")
@@ -178,46 +180,15 @@ def api_distribution():
 
     where_sql = ("WHERE " + " AND ".join(where)) if where else ""
     sql = f"""
-        SELECT duration_category, COUNT(*) AS trips
-        FROM taxi_trips
+        SELECT duration_category, SUM(trips) AS trips
+        FROM dist_by_date_rush_pax
         {where_sql}
         GROUP BY duration_category
     """
     rows = query_db(sql, tuple(params))
     return jsonify({r["duration_category"]: r["trips"] for r in rows})
 
-# ---------- Speed histogram (manual bucketing) ---------- #
-def manual_hist(values, bin_size):
-    """
-    Build a histogram without numpy/pandas helpers.
-    Returns list of (bin_label, count), where label is 'low-high'.
-    """
-    buckets = {}
-    for v in values:
-        if v is None:
-            continue
-        try:
-            x = float(v)
-        except (TypeError, ValueError):
-            continue
-        if x < 0:
-            continue
-        low = int(x // bin_size) * bin_size
-        high = low + bin_size
-        label = f"{low}-{high}"
-        buckets[label] = buckets.get(label, 0) + 1
-
-    # Convert to sorted list by numeric low bound (manual insertion sort)
-    items = list(buckets.items())
-    for i in range(1, len(items)):
-        key_item = items[i]
-        j = i - 1
-        while j >= 0 and int(items[j][0].split('-')[0]) > int(key_item[0].split('-')[0]):
-            items[j+1] = items[j]
-            j -= 1
-        items[j+1] = key_item
-    return items
-
+# ---------- Speed histogram (bucketed from the per-day rollup) ---------- #
 @app.route("/api/speeds_hist")
 def api_speeds_hist():
     # Optional: start, end; bin_size default 5 km/h
@@ -227,19 +198,26 @@ def api_speeds_hist():
 
     where, params = [], []
     if start:
-        where.append("date(substr(pickup_datetime,1,19)) >= date(?)")
+        where.append("pickup_date >= date(?)")
         params.append(start)
     if end:
-        where.append("date(substr(pickup_datetime,1,19)) <= date(?)")
+        where.append("pickup_date <= date(?)")
         params.append(end)
     where_sql = ("WHERE " + " AND ".join(where)) if where else ""
 
-    sql = f"SELECT trip_speed_kmh FROM taxi_trips {where_sql}"
-    rows = query_db(sql, tuple(params))
-    values = [row["trip_speed_kmh"] for row in rows]
-
-    hist = manual_hist(values, bin_size)
-    return jsonify({"bins": [{"label": k, "count": v} for k, v in hist]})
+    # Re-bucket the per-day 1 km/h counts; floor(floor(v) / n) == floor(v / n) for integer n
+    sql = f"""
+        SELECT speed_floor / ? AS bin_idx, SUM(trips) AS trips
+        FROM speeds_hist_by_date
+        {where_sql}
+        GROUP BY bin_idx
+        ORDER BY bin_idx
+    """
+    rows = query_db(sql, (bin_size, *params))
+    return jsonify({"bins": [
+        {"label": f"{r['bin_idx'] * bin_size}-{(r['bin_idx'] + 1) * bin_size}", "count": r["trips"]}
+        for r in rows
+    ]})
 
 if __name__ == "__main__":
     app.run(debug=(FLASK_DEBUG == "1"))
@@ -1,13 +1,58 @@
 import os
-import math
 import sqlite3
-from datetime import time
+import time
+import numpy as np
 import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+from pyarrow import csv as pacsv
+from schema import CREATE_TABLE_SQL, INDEXES, ROLLUPS, ensure_generated_columns
+
+# Set USE_NUMBA=0 to force the NumPy feature path (e.g. to A/B the timings below)
+USE_NUMBA = os.getenv("USE_NUMBA", "1") == "1"
+
+featurize = None
+if USE_NUMBA:
+    try:
+        from kernels import featurize  # numba-compiled fused feature pass (optional)
+    except ImportError:
+        pass
 
 CSV_PATH = "data/raw/train_unzipped/train.csv"
 DB_PATH = "data/db/nyc.db"
 LOG_PATH = "logs/cleaning.log"
-CHUNK_SIZE = 100_000  # adjust if memory is tight
+
+# Explicit column types so pyarrow doesn't have to infer them.
+# Timestamps stay text (I store them verbatim); read_csv_frame adds parsed copies.
+CSV_COLUMN_TYPES = {
+    "id": pa.string(),
+    "vendor_id": pa.int64(),
+    "pickup_datetime": pa.string(),
+    "dropoff_datetime": pa.string(),
+    "passenger_count": pa.int64(),
+    "pickup_longitude": pa.float64(),
+    "pickup_latitude": pa.float64(),
+    "dropoff_longitude": pa.float64(),
+    "dropoff_latitude": pa.float64(),
+    "store_and_fwd_flag": pa.string(),
+    "trip_duration": pa.int64(),
+}
+TIMESTAMP_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+# ------------------- Loading ------------------- #
+
+def read_csv_frame(path):
+    """
+    I read the whole CSV in one go (pyarrow parses blocks on all cores) into a pandas DataFrame.
+    It also gets pickup_dt/dropoff_dt parsed in Arrow; unparsable values become NaT.
+    """
+    table = pacsv.read_csv(
+        path,
+        convert_options=pacsv.ConvertOptions(column_types=CSV_COLUMN_TYPES, strings_can_be_null=True),
+    )
+    for src, dst in (("pickup_datetime", "pickup_dt"), ("dropoff_datetime", "dropoff_dt")):
+        table = table.append_column(dst, pc.strptime(table[src], format=TIMESTAMP_FORMAT, unit="s", error_is_null=True))
+    return table.to_pandas()
 
 # ------------------- Cleaning ------------------- #
 
@@ -21,95 +66,125 @@ def clean_and_validate(df: pd.DataFrame) -> pd.DataFrame:
     ]
     df = df.dropna(subset=essential_cols)
 
-    # 2) I remove duplicate trip IDs (if any)
-    if "id" in df.columns:
-        df = df.drop_duplicates(subset=["id"])
-
-    # 3) I remove invalid coordinates (rough NYC bbox)
-    df = df[
-        (df["pickup_latitude"].between(40, 41)) &
-        (df["dropoff_latitude"].between(40, 41)) &
-        (df["pickup_longitude"].between(-75, -72)) &
-        (df["dropoff_longitude"].between(-75, -72))
-    ]
+    # 2) I remove invalid coordinates (rough NYC bbox) and
+    # 3) non-positive durations, with one mask built from the raw arrays
+    plat = df["pickup_latitude"].to_numpy()
+    plon = df["pickup_longitude"].to_numpy()
+    dlat = df["dropoff_latitude"].to_numpy()
+    dlon = df["dropoff_longitude"].to_numpy()
+    dur = df["trip_duration"].to_numpy()
+    mask = (
+        (plat >= 40) & (plat <= 41) &
+        (dlat >= 40) & (dlat <= 41) &
+        (plon >= -75) & (plon <= -72) &
+        (dlon >= -75) & (dlon <= -72) &
+        (dur > 0)
+    )
+    df = df.iloc[mask]
 
-    # 4) I remove non-positive durations
-    df = df[df["trip_duration"] > 0]
+    # 4) I drop rows where datetimes failed to parse or are inverted (NaT never compares >=)
+    good_time = df["dropoff_dt"].to_numpy() >= df["pickup_dt"].to_numpy()
+    bad_count = int((~good_time).sum())
+    if bad_count:
+        os.makedirs(os.path.dirname(LOG_PATH), exist_ok=True)
+        with open(LOG_PATH, "a", encoding="utf-8") as f:
+            f.write(f"[TIME] Excluding {bad_count} rows with invalid/inverted timestamps\n")
+        df = df.iloc[good_time]
+        print(f"⏱️  Dropped {bad_count} rows due to invalid time order.")
 
-    return df
+    # 5) I remove duplicate trip IDs last, so the first *valid* row of each id is the one kept
+    if "id" in df.columns:
+        df = df.drop_duplicates(subset=["id"])
+    return df.copy()  # own the frame; add_features adds columns to it
 
 # ------------------- Feature Engineering ------------------- #
 
-def to_datetime_safe(series):
-    """I convert strings to pandas datetimes; invalid rows become NaT (not-a-time)."""
-    return pd.to_datetime(series, errors="coerce", infer_datetime_format=True, utc=False)
-
 def haversine_km(lat1, lon1, lat2, lon2):
-    """I compute great-circle distance in kilometers using the Haversine formula."""
+    """I compute great-circle distance in kilometers using the Haversine formula (works on whole NumPy arrays)."""
     R = 6371.0088  # mean Earth radius in km
     # convert degrees to radians
-    lat1 = math.radians(lat1); lon1 = math.radians(lon1)
-    lat2 = math.radians(lat2); lon2 = math.radians(lon2)
+    lat1 = np.radians(lat1); lon1 = np.radians(lon1)
+    lat2 = np.radians(lat2); lon2 = np.radians(lon2)
     dlat = lat2 - lat1
     dlon = lon2 - lon1
-    a = (math.sin(dlat / 2) ** 2
-         + math.cos(lat1) * math.cos(lat2) * math.sin(dlon / 2) ** 2)
-    c = 2 * math.atan2(math.sqrt(a), math.sqrt(1 - a))
+    a = (np.sin(dlat / 2) ** 2
+         + np.cos(lat1) * np.cos(lat2) * np.sin(dlon / 2) ** 2)
+    # arcsin(sqrt(a)) == atan2(sqrt(a), sqrt(1 - a)) but saves a sqrt and a trig call
+    c = 2 * np.arcsin(np.sqrt(a))
     return R * c
 
 def compute_distance_series(df):
-    """I compute Haversine distance for each row."""
-    return df.apply(
-        lambda r: haversine_km(
-            r["pickup_latitude"], r["pickup_longitude"],
-            r["dropoff_latitude"], r["dropoff_longitude"]
-        ),
-        axis=1
+    """I compute Haversine distance for all rows at once (no per-row Python calls)."""
+    dist = haversine_km(
+        df["pickup_latitude"].to_numpy(), df["pickup_longitude"].to_numpy(),
+        df["dropoff_latitude"].to_numpy(), df["dropoff_longitude"].to_numpy()
     )
+    return pd.Series(dist, index=df.index)
 
 def categorize_duration(seconds):
-    """I bucket the trip duration into short/medium/long for simple analysis."""
-    if seconds <= 300:     # ≤ 5 minutes
-        return "short"
-    if seconds <= 1200:    # 5–20 minutes
-        return "medium"
-    return "long"          # > 20 minutes
+    """I bucket trip durations into short/medium/long for simple analysis (whole column at once)."""
+    seconds = np.asarray(seconds)
+    return np.select(
+        [seconds <= 300,     # ≤ 5 minutes
+         seconds <= 1200],   # 5–20 minutes
+        ["short", "medium"],
+        default="long"       # > 20 minutes
+    ).astype(object)
+
+def seconds_since_midnight(dt):
+    """I turn a datetime Series into seconds since midnight (NaT stays NaN)."""
+    return dt.dt.hour * 3600 + dt.dt.minute * 60 + dt.dt.second
 
 def is_rush_hour(dt):
-    """I flag NYC-like rush hours: 7–9 AM and 5–7 PM local time."""
-    if pd.isna(dt):
-        return 0
-    t = dt.time()
-    morning = time(7, 0) <= t <= time(9, 0)
-    evening = time(17, 0) <= t <= time(19, 0)
-    return int(morning or evening)
+    """I flag NYC-like rush hours: 7–9 AM and 5–7 PM local time (whole column at once)."""
+    secs = seconds_since_midnight(dt).to_numpy(dtype=np.float64)
+    morning = (secs >= 7 * 3600) & (secs <= 9 * 3600)
+    evening = (secs >= 17 * 3600) & (secs <= 19 * 3600)
+    return (morning | evening).astype(np.int8)
+
+def kernel_input(series, dtype):
+    """I hand featurize a writable array of the exact dtype its compiled signature expects."""
+    return np.require(series.to_numpy(dtype=dtype), requirements="W")
+
+DURATION_LABELS = np.array(["short", "medium", "long"], dtype=object)  # indexed by featurize's category codes
 
 def add_features(df: pd.DataFrame) -> pd.DataFrame:
     """I add distance, speed, duration_category, and rush_hour_flag; I also log anomalies."""
-    # 1) parse timestamps
-    df["pickup_dt"] = to_datetime_safe(df["pickup_datetime"])
-    df["dropoff_dt"] = to_datetime_safe(df["dropoff_datetime"])
-
-    # 2) drop rows where datetimes failed to parse or are inverted
-    before = len(df)
-    bad_time = df[df["pickup_dt"].isna() | df["dropoff_dt"].isna() | (df["dropoff_dt"] < df["pickup_dt"])]
-    if not bad_time.empty:
-        os.makedirs(os.path.dirname(LOG_PATH), exist_ok=True)
-        with open(LOG_PATH, "a", encoding="utf-8") as f:
-            f.write(f"[TIME] Excluding {len(bad_time)} rows with invalid/inverted timestamps\n")
-        df = df.drop(bad_time.index)
-
-    # 3) compute distance (km)
-    df["trip_distance_km"] = compute_distance_series(df)
+    # 1-2) timestamps arrive parsed from read_csv_frame (pickup_dt / dropoff_dt) and
+    # clean_and_validate has already dropped invalid/inverted ones
+
+    if featurize is not None:
+        # 3-6) distance, speed, duration category and rush hour flag in one compiled pass
+        n = len(df)
+        dist = np.empty(n)
+        speed = np.empty(n)
+        cat = np.empty(n, np.int8)
+        rush = np.empty(n, np.int8)
+        featurize(
+            kernel_input(df["pickup_latitude"], np.float64),
+            kernel_input(df["pickup_longitude"], np.float64),
+            kernel_input(df["dropoff_latitude"], np.float64),
+            kernel_input(df["dropoff_longitude"], np.float64),
+            kernel_input(df["trip_duration"], np.int64),
+            kernel_input(seconds_since_midnight(df["pickup_dt"]), np.int64),
+            dist, speed, cat, rush,
+        )
+        df["trip_distance_km"] = dist
+        df["trip_speed_kmh"] = speed
+        df["duration_category"] = DURATION_LABELS[cat]
+        df["rush_hour_flag"] = rush
+    else:
+        # 3) compute distance (km)
+        df["trip_distance_km"] = compute_distance_series(df)
 
-    # 4) speed (km/h); protect against division by zero
-    df["trip_speed_kmh"] = (df["trip_distance_km"] / df["trip_duration"].replace(0, pd.NA)) * 3600
+        # 4) speed (km/h); protect against division by zero
+        df["trip_speed_kmh"] = (df["trip_distance_km"] / df["trip_duration"].replace(0, pd.NA)) * 3600
 
-    # 5) duration category
-    df["duration_category"] = df["trip_duration"].apply(categorize_duration)
+        # 5) duration category
+        df["duration_category"] = categorize_duration(df["trip_duration"])
 
-    # 6) rush hour flag from pickup time
-    df["rush_hour_flag"] = df["pickup_dt"].apply(is_rush_hour)
+        # 6) rush hour flag from pickup time
+        df["rush_hour_flag"] = is_rush_hour(df["pickup_dt"])
 
     # 7) log suspicious values (extreme speeds or distances)
     suspicious = df[(df["trip_speed_kmh"] > 120) | (df["trip_distance_km"] > 100)]
@@ -117,16 +192,13 @@ def add_features(df: pd.DataFrame) -> pd.DataFrame:
         with open(LOG_PATH, "a", encoding="utf-8") as f:
             f.write(f"[ANOMALY] {len(suspicious)} rows with speed>120 km/h or distance>100 km\n")
 
-    after = len(df)
-    dropped = before - after
-    if dropped > 0:
-        print(f"⏱️  Parsed timestamps & added features. Dropped {dropped} rows due to invalid time order.")
-    else:
-        print("⏱️  Parsed timestamps & added features. No time-order drops in this chunk.")
+    print("⏱️  Added features.")
     return df
 
 # ------------------- DB Insert ------------------- #
 
+ROW_SLICE = 100_000  # rows converted to Python objects at a time while inserting
+
 COLUMNS = [
     "id","vendor_id","pickup_datetime","dropoff_datetime","passenger_count",
     "pickup_longitude","pickup_latitude","dropoff_longitude","dropoff_latitude",
@@ -134,59 +206,78 @@ COLUMNS = [
     "duration_category","rush_hour_flag"
 ]
 
-def insert_chunk_to_db(df: pd.DataFrame):
-    """I insert a cleaned+enriched chunk into SQLite, skipping duplicates."""
-    os.makedirs(os.path.dirname(DB_PATH), exist_ok=True)
-    conn = sqlite3.connect(DB_PATH)
+def refresh_rollups(conn: sqlite3.Connection):
+    """I rebuild the per-day summary tables in one transaction so readers see old or new, never half."""
+    conn.execute("BEGIN")
+    try:
+        for name, select in ROLLUPS.items():
+            conn.execute(f"DROP TABLE IF EXISTS {name}")
+            conn.execute(f"CREATE TABLE {name} AS {select}")
+        conn.execute("COMMIT")
+    except BaseException:
+        # Keep the previous rollups intact; skip if SQLite already rolled back, so the original error surfaces
+        if conn.in_transaction:
+            conn.execute("ROLLBACK")
+        raise
+
+def setup_db(conn: sqlite3.Connection):
+    """I run the once-per-load setup: PRAGMAs, schema, index drops and the staging table."""
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")  # no fsync per commit; WAL keeps the DB consistent
+    conn.execute("PRAGMA temp_store=MEMORY")
+    conn.execute("PRAGMA cache_size=-200000")  # ~200 MB page cache
+    conn.execute(CREATE_TABLE_SQL)
+    ensure_generated_columns(conn)
+    for name in INDEXES:
+        conn.execute(f"DROP INDEX IF EXISTS {name}")
+    # Unindexed, constraint-free landing table for the load (temp: lives in memory, gone on close)
+    conn.execute(f"CREATE TEMP TABLE staging AS SELECT {', '.join(COLUMNS)} FROM taxi_trips WHERE 0")
+
+def row_iter(df: pd.DataFrame):
+    """
+    I yield one row tuple at a time for executemany. Rows are converted to Python objects
+    one slice at a time, so only ROW_SLICE rows are ever held as an object array.
+    """
+    for start in range(0, len(df), ROW_SLICE):
+        # NaN -> None for SQLite in one pass over the slice
+        arr = df.iloc[start:start + ROW_SLICE][COLUMNS].to_numpy(dtype=object, na_value=None)
+        yield from map(tuple, arr)
+
+def insert_to_db(df: pd.DataFrame, conn: sqlite3.Connection):
+    """
+    I insert the cleaned+enriched rows in one transaction, skipping duplicates:
+    rows go into the unindexed staging table first, then merge into taxi_trips with one INSERT ... SELECT.
+    """
     cur = conn.cursor()
 
-    # Ensure table exists (defensive)
-    cur.execute("""
-        CREATE TABLE IF NOT EXISTS taxi_trips (
-            id TEXT PRIMARY KEY,
-            vendor_id TEXT,
-            pickup_datetime TEXT,
-            dropoff_datetime TEXT,
-            passenger_count INTEGER,
-            pickup_longitude REAL,
-            pickup_latitude REAL,
-            dropoff_longitude REAL,
-            dropoff_latitude REAL,
-            store_and_fwd_flag TEXT,
-            trip_duration INTEGER,
-            trip_distance_km REAL,
-            trip_speed_kmh REAL,
-            duration_category TEXT,
-            rush_hour_flag INTEGER
+    cur.execute("BEGIN")
+    try:
+        cur.executemany(
+            """
+            INSERT INTO staging (
+                id, vendor_id, pickup_datetime, dropoff_datetime, passenger_count,
+                pickup_longitude, pickup_latitude, dropoff_longitude, dropoff_latitude,
+                store_and_fwd_flag, trip_duration, trip_distance_km, trip_speed_kmh,
+                duration_category, rush_hour_flag
+            ) VALUES (?,?,?,?,?,?,?,?,?,?,?,?,?,?,?)
+            """,
+            row_iter(df)
         )
-    """)
-
-    # Convert NaN to None for SQLite
-    records = []
-    for _, r in df[COLUMNS].iterrows():
-        rec = []
-        for v in r.tolist():
-            if isinstance(v, float) and (pd.isna(v)):  # NaN
-                rec.append(None)
-            else:
-                rec.append(v)
-        records.append(tuple(rec))
-
-    cur.executemany(
-        """
-        INSERT OR IGNORE INTO taxi_trips (
-            id, vendor_id, pickup_datetime, dropoff_datetime, passenger_count,
-            pickup_longitude, pickup_latitude, dropoff_longitude, dropoff_latitude,
-            store_and_fwd_flag, trip_duration, trip_distance_km, trip_speed_kmh,
-            duration_category, rush_hour_flag
-        ) VALUES (?,?,?,?,?,?,?,?,?,?,?,?,?,?,?)
-        """,
-        records
-    )
-    conn.commit()
-    inserted = cur.rowcount  # NOTE: sqlite returns -1 for executemany; we’ll just print length
-    conn.close()
-    print(f"📥 Inserted {len(records)} rows (duplicates ignored).")
+        # Merge in primary-key order so the id B-tree is filled sequentially instead of probed at random
+        cur.execute(f"""
+            INSERT OR IGNORE INTO taxi_trips ({", ".join(COLUMNS)})
+            SELECT {", ".join(COLUMNS)} FROM staging ORDER BY id
+        """)
+        cur.execute("DELETE FROM staging")
+        cur.execute("COMMIT")
+    except BaseException:
+        # Leave no open transaction behind: main() rebuilds indexes on this connection afterwards.
+        # SQLite may already have rolled back (e.g. SQLITE_FULL); a bare ROLLBACK would then
+        # raise and hide the original error.
+        if conn.in_transaction:
+            cur.execute("ROLLBACK")
+        raise
+    print(f"📥 Inserted {len(df)} rows (duplicates ignored).")
 
 # ------------------- Runner ------------------- #
 
@@ -194,28 +285,39 @@ def main():
     if not os.path.exists(CSV_PATH):
         raise FileNotFoundError(f"CSV not found at {CSV_PATH}")
     print("✅ Found my dataset at:", CSV_PATH)
+    print("⚙️  Feature path:", "numba" if featurize is not None else "numpy")
 
-    # Stream the full CSV in chunks so I don't blow up memory
-    total_rows = 0
-    chunk_idx = 0
+    # Read everything at once: ~1.4M rows fit comfortably in memory as columnar arrays
+    raw = read_csv_frame(CSV_PATH)
+    print(f"📖 Read {len(raw)} rows")
 
-    for chunk in pd.read_csv(CSV_PATH, chunksize=CHUNK_SIZE):
-        chunk_idx += 1
-        print(f"\n--- Processing chunk {chunk_idx} (rows: {len(chunk)}) ---")
+    cleaned = clean_and_validate(raw)
+    print(f"✅ After validation: {len(cleaned)} rows")
 
-        cleaned = clean_and_validate(chunk)
-        print(f"✅ After validation: {len(cleaned)} rows")
+    # One connection and one transaction for the whole load
+    os.makedirs(os.path.dirname(DB_PATH), exist_ok=True)
+    conn = sqlite3.connect(DB_PATH, isolation_level=None)
+    setup_db(conn)
 
+    total_rows = 0
+    try:
         if len(cleaned) == 0:
-            print("ℹ️  Nothing to insert from this chunk (all invalid).")
-            continue
-
-        enriched = add_features(cleaned)
-
-        insert_chunk_to_db(enriched)
-
-        total_rows += len(enriched)
-        print(f"✅ Running total inserted: {total_rows}")
+            print("ℹ️  Nothing to insert (all rows invalid).")
+        else:
+            t0 = time.perf_counter()
+            enriched = add_features(cleaned)
+            t1 = time.perf_counter()
+            insert_to_db(enriched, conn)
+            t2 = time.perf_counter()
+            print(f"⏲️  add_features {t1 - t0:.2f}s, insert {t2 - t1:.2f}s")
+            total_rows = len(enriched)
+    finally:
+        print("🗂️  Rebuilding indexes...")
+        for name, target in INDEXES.items():
+            conn.execute(f"CREATE INDEX IF NOT EXISTS {name} ON {target}")
+        print("📊 Refreshing summary tables...")
+        refresh_rollups(conn)
+        conn.close()
 
     print(f"\n🎉 Done. Total rows inserted into SQLite: {total_rows}")
     print(f"🧾 Logs (if any): {LOG_PATH}")
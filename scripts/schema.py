@@ -0,0 +1,78 @@
+"""
+SQLite schema shared by the ETL (scripts/clean_data.py) and the API (app.py).
+Both sides create these objects, so they must come from one definition.
+"""
+import sqlite3
+
+CREATE_TABLE_SQL = """
+    CREATE TABLE IF NOT EXISTS taxi_trips (
+        id TEXT PRIMARY KEY,
+        vendor_id TEXT,
+        pickup_datetime TEXT,
+        dropoff_datetime TEXT,
+        passenger_count INTEGER,
+        pickup_longitude REAL,
+        pickup_latitude REAL,
+        dropoff_longitude REAL,
+        dropoff_latitude REAL,
+        store_and_fwd_flag TEXT,
+        trip_duration INTEGER,
+        trip_distance_km REAL,
+        trip_speed_kmh REAL,
+        duration_category TEXT,
+        rush_hour_flag INTEGER
+    )
+"""
+
+# Generated columns so date/hour filters can use an index
+GENERATED_COLUMNS = {
+    "pickup_date": "TEXT GENERATED ALWAYS AS (substr(pickup_datetime,1,10)) VIRTUAL",
+    "pickup_hour": "INTEGER GENERATED ALWAYS AS (CAST(substr(pickup_datetime,12,2) AS INTEGER)) VIRTUAL",
+}
+
+def ensure_generated_columns(conn: sqlite3.Connection):
+    """Add any missing GENERATED_COLUMNS in place (DBs created before they existed)."""
+    existing = {r[1] for r in conn.execute("PRAGMA table_xinfo(taxi_trips)")}
+    for name, ddl in GENERATED_COLUMNS.items():
+        if name not in existing:
+            conn.execute(f"ALTER TABLE taxi_trips ADD COLUMN {name} {ddl}")
+
+# Dashboard indexes; the ETL drops them for the bulk load and rebuilds them once at the end
+INDEXES = {
+    "idx_pickup_datetime": "taxi_trips (pickup_datetime)",
+    "idx_duration_category": "taxi_trips (duration_category)",
+    "idx_speed": "taxi_trips (trip_speed_kmh)",
+    "idx_rush": "taxi_trips (rush_hour_flag)",
+    "idx_pickup_date": "taxi_trips (pickup_date)",
+    "idx_pickup_hour": "taxi_trips (pickup_hour)",
+}
+
+# Per-day rollups the dashboard reads instead of scanning taxi_trips.
+# The ETL rebuilds them after every load; app.py only creates them if missing.
+ROLLUPS = {
+    "summary_by_date": """
+        SELECT pickup_date,
+               COUNT(*) AS trips,
+               COUNT(trip_duration) AS duration_n, SUM(trip_duration) AS duration_sum,
+               COUNT(trip_distance_km) AS km_n, SUM(trip_distance_km) AS km_sum,
+               COUNT(trip_speed_kmh) AS kmh_n, SUM(trip_speed_kmh) AS kmh_sum
+        FROM taxi_trips
+        GROUP BY pickup_date
+    """,
+    "dist_by_date_rush_pax": """
+        SELECT pickup_date, rush_hour_flag, passenger_count, duration_category, COUNT(*) AS trips
+        FROM taxi_trips
+        GROUP BY pickup_date, rush_hour_flag, passenger_count, duration_category
+    """,
+    "busiest_hours_by_date": """
+        SELECT pickup_date, pickup_hour, COUNT(*) AS trips
+        FROM taxi_trips
+        GROUP BY pickup_date, pickup_hour
+    """,
+    "speeds_hist_by_date": """
+        SELECT pickup_date, CAST(trip_speed_kmh AS INTEGER) AS speed_floor, COUNT(*) AS trips
+        FROM taxi_trips
+        WHERE trip_speed_kmh >= 0
+        GROUP BY pickup_date, speed_floor
+    """,
+}